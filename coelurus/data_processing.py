@@ -8,7 +8,7 @@ The output from the module is ready to be used by the machine learning part of t
 import pandas as pd
 import ConfigParser
 import numpy as np
-from multiprocessing.pool import ThreadPool
+from coelurus import kernels
 
 
 class Loader(object):
@@ -191,28 +191,7 @@ class DataProcessor(object):
         """
         Imputes missing values if an NA or 0 is present between two non-null values using mean imputation.
         """
-        profiles = input_data.iloc[:, 1:].copy()
-        profiles[profiles == 0] = np.nan
-
-        def mean_impute(arr):
-            """
-            Imputes mean value in the array.
-            :param arr: 3 element array, middle value to be imputed using a mean
-            :return: imputed array
-            """
-            if arr[1] == np.nan:
-                print("Mid value in the array was not NaN, something went wrong with imputation.")
-                return arr
-
-            arr[1] = np.round((arr[0]+arr[2])/2, 3)
-            return arr
-
-        for i in range(profiles.shape[1] - 2):
-            window = profiles.iloc[:, i:i+3]
-            # which rows should be imputed (only if middle value is the only missing)
-            imp_row = np.all(window.isna().apply(lambda x: x == [False, True, False], axis=1), axis=1)
-            imp_row = np.where(imp_row)[0]
-            profiles.iloc[imp_row, i:i+3] = window.loc[imp_row].apply(lambda x: mean_impute(x), axis=1)
+        profiles = kernels.impute_missing_values(input_data.iloc[:, 1:].values)
 
         input_data.iloc[:, 1:] = profiles
         input_data = self.set_nas_to_0(input_data)
@@ -282,18 +261,10 @@ class DataProcessor(object):
     def remove_singletons(self, input_data):
         """
         Sets features surrounded by 0's to 0.
-        :param input_data:
-        :return:
-        todo: fill docstrings
+        :param input_data: pandas DataFrame with input profiles.
+        :return: pandas DataFrame with singletons removed.
         """
-        profiles = input_data.iloc[:, 1:]
-
-        for i in range(profiles.shape[1] - 2):
-            window = profiles.iloc[:, i:i + 3]
-            win_bool = window == 0
-            idx_to_flatten = win_bool.apply(lambda x: np.all(x == [True, False, True]), axis=1)
-            window.loc[idx_to_flatten, window.columns[1]] = 0
-            profiles.iloc[:, i:i + 3] = window
+        profiles = kernels.remove_singletons(input_data.iloc[:, 1:].values)
         input_data.iloc[:, 1:] = profiles
 
         return input_data
@@ -337,11 +308,7 @@ class DataProcessor(object):
         :return:
         """
         nthreads = self.config.getint('system_options', 'num_threads')
-        pool = ThreadPool(nthreads)
-
-        results = pool.map(self.transform_wrapper, self.replicate_data)
-        pool.close()
-        pool.join()
+        results = kernels.map_replicates(self.transform_wrapper, self.replicate_data, nthreads)
         self.replicate_data_transformed = results
         self.data_imputed = True
         print("Filters applied to .replicate_data list.")
\ No newline at end of file
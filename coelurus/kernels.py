@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+"""
+This module holds the row-wise numerical kernels used by the data processing and machine learning parts.
+
+Each kernel has a Numba implementation (parallel over profiles using prange) and a pure NumPy fallback.
+The backend is selected at import: Numba is used if it is installed, NumPy otherwise.
+The selected backend name is stored in BACKEND.
+"""
+import numpy as np
+from multiprocessing.pool import ThreadPool
+
+try:
+    import numba
+    from numba import njit, prange
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+_EPS = 10 * np.finfo(np.float64).eps  # added to the component sizes, same as in scikit-learn
+
+
+def _remove_singletons_numpy(values):
+    """
+    Sets features surrounded by 0's to 0. Loops over windows and vectorizes over profiles.
+    :param values: 2D numpy array with profiles (rows) and fractions (columns), modified in place.
+    :return: 2D numpy array with singletons set to 0.
+    """
+    for i in range(values.shape[1] - 2):
+        to_flatten = (values[:, i] == 0) & (values[:, i + 1] != 0) & (values[:, i + 2] == 0)
+        values[to_flatten, i + 1] = 0
+
+    return values
+
+
+def _impute_missing_values_numpy(values):
+    """
+    Imputes single NaNs between two non-NaN values using their mean. Loops over windows and vectorizes over profiles.
+    :param values: 2D numpy array with profiles (rows) and fractions (columns), modified in place.
+    :return: 2D numpy array with imputed values.
+    """
+    missing = np.isnan(values)
+    for i in range(values.shape[1] - 2):
+        to_impute = ~missing[:, i] & missing[:, i + 1] & ~missing[:, i + 2]
+        values[to_impute, i + 1] = np.round((values[to_impute, i] + values[to_impute, i + 2]) / 2, 3)
+        missing[to_impute, i + 1] = False
+
+    return values
+
+
+def _weighted_log_prob_numpy(x, weights, means, variances):
+    """
+    Computes log(weight * N(x | mean, variance)) for each sample and component.
+    :return: 2D numpy array of shape (samples, components)
+    """
+    return (np.log(weights) - 0.5 * (np.log(2 * np.pi) + np.log(variances) +
+                                     (x[:, np.newaxis] - means) ** 2 / variances))
+
+
+def _log_sum_exp_numpy(log_prob):
+    """
+    Row-wise log(sum(exp(log_prob))), stable for large negative values.
+    """
+    max_log_prob = log_prob.max(axis=1)
+    return max_log_prob + np.log(np.exp(log_prob - max_log_prob[:, np.newaxis]).sum(axis=1))
+
+
+def _fit_gaussian_mixtures_numpy(samples, means_init, reg_covar, tol, max_iter):
+    """
+    Runs EM for 1D Gaussian mixtures, one profile (row of samples) at a time, vectorized over samples.
+    See fit_gaussian_mixtures() for parameters.
+    """
+    n_rows = samples.shape[0]
+    n_components = means_init.shape[1]
+    weights = np.empty((n_rows, n_components))
+    means = means_init.astype(np.float64)
+    variances = np.empty((n_rows, n_components))
+    log_likelihood = np.empty(n_rows)
+
+    for row in range(n_rows):
+        x = samples[row]
+        weights[row] = 1.0 / n_components
+        variances[row] = x.var() + reg_covar
+        lower_bound = -np.inf
+
+        for _ in range(max_iter):
+            # E-step
+            log_prob = _weighted_log_prob_numpy(x, weights[row], means[row], variances[row])
+            log_prob_norm = _log_sum_exp_numpy(log_prob)
+            resp = np.exp(log_prob - log_prob_norm[:, np.newaxis])
+
+            # M-step
+            nk = resp.sum(axis=0) + _EPS
+            sum_x = resp.T.dot(x)
+            sum_x2 = resp.T.dot(x * x)
+            means[row] = sum_x / nk
+            variances[row] = sum_x2 / nk - 2 * means[row] * sum_x / nk + means[row] ** 2 + reg_covar
+            weights[row] = nk / nk.sum()
+
+            prev_lower_bound = lower_bound
+            lower_bound = log_prob_norm.mean()
+            if abs(lower_bound - prev_lower_bound) < tol:
+                break
+
+        log_prob = _weighted_log_prob_numpy(x, weights[row], means[row], variances[row])
+        log_likelihood[row] = _log_sum_exp_numpy(log_prob).mean()
+
+    return weights, means, variances, log_likelihood
+
+
+if HAS_NUMBA:
+
+    @njit(parallel=True, cache=True)
+    def _remove_singletons_numba(values):
+        """
+        Sets features surrounded by 0's to 0. Windows are processed sequentially, profiles in parallel.
+        """
+        for row in prange(values.shape[0]):
+            for i in range(values.shape[1] - 2):
+                if values[row, i] == 0 and values[row, i + 1] != 0 and values[row, i + 2] == 0:
+                    values[row, i + 1] = 0
+
+        return values
+
+    @njit(parallel=True, cache=True)
+    def _impute_missing_values_numba(values):
+        """
+        Imputes single NaNs between two non-NaN values using their mean.
+        Windows are processed sequentially, profiles in parallel.
+        """
+        for row in prange(values.shape[0]):
+            for i in range(values.shape[1] - 2):
+                left = values[row, i]
+                right = values[row, i + 2]
+                if not np.isnan(left) and np.isnan(values[row, i + 1]) and not np.isnan(right):
+                    values[row, i + 1] = np.round((left + right) / 2, 3)
+
+        return values
+
+    @njit(cache=True)
+    def _weighted_log_prob_numba(x, weights, means, variances, log_prob):
+        """
+        Fills log_prob with log(weight * N(x | mean, variance)) for each component of a single sample.
+        :return: log of the summed probabilities over the components.
+        """
+        max_log_prob = -np.inf
+        for c in range(weights.shape[0]):
+            log_prob[c] = (np.log(weights[c]) - 0.5 * (np.log(2 * np.pi) + np.log(variances[c]) +
+                                                       (x - means[c]) ** 2 / variances[c]))
+            if log_prob[c] > max_log_prob:
+                max_log_prob = log_prob[c]
+
+        total = 0.0
+        for c in range(weights.shape[0]):
+            total += np.exp(log_prob[c] - max_log_prob)
+
+        return max_log_prob + np.log(total)
+
+    @njit(parallel=True, cache=True)
+    def _fit_gaussian_mixtures_numba(samples, means_init, reg_covar, tol, max_iter):
+        """
+        Runs EM for 1D Gaussian mixtures, profiles (rows of samples) in parallel.
+        See fit_gaussian_mixtures() for parameters.
+        """
+        n_rows, n_samples = samples.shape
+        n_components = means_init.shape[1]
+        weights = np.empty((n_rows, n_components))
+        means = means_init.astype(np.float64)
+        variances = np.empty((n_rows, n_components))
+        log_likelihood = np.empty(n_rows)
+
+        for row in prange(n_rows):
+            x = samples[row]
+            row_weights = weights[row]
+            row_means = means[row]
+            row_variances = variances[row]
+            row_weights[:] = 1.0 / n_components
+            row_variances[:] = np.var(x) + reg_covar
+
+            log_prob = np.empty(n_components)
+            nk = np.empty(n_components)
+            sum_x = np.empty(n_components)
+            sum_x2 = np.empty(n_components)
+            lower_bound = -np.inf
+
+            for _ in range(max_iter):
+                # E-step, accumulating the sufficient statistics for the M-step on the fly
+                nk[:] = 0.0
+                sum_x[:] = 0.0
+                sum_x2[:] = 0.0
+                log_prob_norm = 0.0
+                for j in range(n_samples):
+                    sample_norm = _weighted_log_prob_numba(x[j], row_weights, row_means, row_variances, log_prob)
+                    log_prob_norm += sample_norm
+                    for c in range(n_components):
+                        resp = np.exp(log_prob[c] - sample_norm)
+                        nk[c] += resp
+                        sum_x[c] += resp * x[j]
+                        sum_x2[c] += resp * x[j] * x[j]
+
+                # M-step
+                nk_total = 0.0
+                for c in range(n_components):
+                    nk[c] += _EPS
+                    nk_total += nk[c]
+                for c in range(n_components):
+                    row_means[c] = sum_x[c] / nk[c]
+                    row_variances[c] = (sum_x2[c] / nk[c] - 2 * row_means[c] * sum_x[c] / nk[c] +
+                                        row_means[c] ** 2 + reg_covar)
+                    row_weights[c] = nk[c] / nk_total
+
+                prev_lower_bound = lower_bound
+                lower_bound = log_prob_norm / n_samples
+                if abs(lower_bound - prev_lower_bound) < tol:
+                    break
+
+            log_prob_norm = 0.0
+            for j in range(n_samples):
+                log_prob_norm += _weighted_log_prob_numba(x[j], row_weights, row_means, row_variances, log_prob)
+            log_likelihood[row] = log_prob_norm / n_samples
+
+        return weights, means, variances, log_likelihood
+
+    BACKEND = 'numba'
+    _remove_singletons = _remove_singletons_numba
+    _impute_missing_values = _impute_missing_values_numba
+    _fit_gaussian_mixtures = _fit_gaussian_mixtures_numba
+
+else:
+    BACKEND = 'numpy'
+    _remove_singletons = _remove_singletons_numpy
+    _impute_missing_values = _impute_missing_values_numpy
+    _fit_gaussian_mixtures = _fit_gaussian_mixtures_numpy
+
+
+def remove_singletons(values):
+    """
+    Sets features surrounded by 0's to 0, going from left to right (a flattened feature can create the next singleton).
+    :param values: 2D array-like with profiles (rows) and fractions (columns).
+    :return: 2D numpy array (float64 copy) with singletons set to 0.
+    """
+    return _remove_singletons(np.array(values, dtype=np.float64))
+
+
+def impute_missing_values(values):
+    """
+    Imputes a missing value if it is present between two non-missing values using their mean (rounded to 3 decimals),
+    going from left to right.
+    :param values: 2D array-like with profiles (rows) and fractions (columns), missing values as NaN or 0.
+    :return: 2D numpy array (float64 copy) with imputed values, other missing values are set to NaN.
+    """
+    values = np.array(values, dtype=np.float64)
+    values[values == 0] = np.nan
+    return _impute_missing_values(values)
+
+
+def fit_gaussian_mixtures(samples, means_init, reg_covar=1e-6, tol=1e-3, max_iter=100):
+    """
+    Fits a 1D Gaussian mixture model to each row of samples using EM (as GaussianMixture with spherical covariance
+    in scikit-learn). Weights start uniform and variances start at the variance of the samples.
+    :param samples: 2D array-like with samples of each profile (rows).
+    :param means_init: 2D array-like with initial means of the components for each profile (rows).
+    :param reg_covar: non-negative regularization added to the variances.
+    :param tol: convergence threshold on the change of the mean log-likelihood.
+    :param max_iter: maximal number of EM iterations.
+    :return: tuple of weights, means and variances (2D numpy arrays, profiles x components)
+    and a 1D numpy array with the mean log-likelihood of the samples of each profile.
+    """
+    samples = np.ascontiguousarray(samples, dtype=np.float64)
+    means_init = np.ascontiguousarray(means_init, dtype=np.float64)
+    if samples.shape[0] != means_init.shape[0]:
+        raise ValueError("samples and means_init should have the same number of rows (profiles).")
+
+    return _fit_gaussian_mixtures(samples, means_init, float(reg_covar), float(tol), int(max_iter))
+
+
+def select_gaussian_mixtures(samples, max_components=5, reg_covar=1e-6):
+    """
+    Fits 1 to max_components Gaussian mixtures to each row of samples and keeps the one with the lowest BIC.
+    Initial means are evenly spaced quantiles of the samples of each profile.
+    :param samples: 2D array-like with samples of each profile (rows).
+    :param max_components: maximal number of Gaussian components tried.
+    :param reg_covar: non-negative regularization added to the variances.
+    :return: 1D numpy array with the selected number of components for each profile
+    and a list with, for each profile, a list of tuples holding the means and std. dev. of the selected Gaussians.
+    """
+    samples = np.ascontiguousarray(samples, dtype=np.float64)
+    n_rows, n_samples = samples.shape
+
+    # all initial means in one np.percentile call, it copies the samples on every call
+    quantiles = [100 * (np.arange(n_components) + 0.5) / n_components
+                 for n_components in range(1, max_components + 1)]
+    all_means_init = np.percentile(samples, np.concatenate(quantiles), axis=1).T
+
+    best_bics = np.full(n_rows, np.inf)
+    best_n_components = np.zeros(n_rows, dtype=int)
+    best_models = [None] * n_rows
+    for n_components in range(1, max_components + 1):
+        first = n_components * (n_components - 1) // 2
+        means_init = all_means_init[:, first:first + n_components]
+        weights, means, variances, log_likelihood = fit_gaussian_mixtures(samples, means_init, reg_covar=reg_covar)
+
+        # free parameters of a 1D spherical mixture: means, variances and weights (summing to 1)
+        n_parameters = 3 * n_components - 1
+        bics = -2 * log_likelihood * n_samples + n_parameters * np.log(n_samples)
+        for i in np.where(bics < best_bics)[0]:
+            best_bics[i] = bics[i]
+            best_n_components[i] = n_components
+            best_models[i] = list(zip(means[i], np.sqrt(variances[i])))
+
+    return best_n_components, best_models
+
+
+def map_replicates(func, replicate_data, nthreads):
+    """
+    Applies func to each replicate, using at most nthreads threads.
+    With the NumPy backend the replicates run in a ThreadPool of nthreads.
+    With the Numba backend they run one after another and nthreads (capped at the cores Numba sees) sets the number
+    of threads the kernels spread the profiles over. Numba threading layers can abort or hang when parallel kernels
+    are launched from several threads, so the replicates are not run in a ThreadPool then.
+    :param func: function taking a single replicate.
+    :param replicate_data: list of replicates (e.g. pandas DataFrames).
+    :param nthreads: number of threads, e.g. num_threads from the config.
+    :return: list with the results of func for each replicate.
+    """
+    if BACKEND == 'numba':
+        numba.set_num_threads(min(nthreads, numba.config.NUMBA_NUM_THREADS))
+        return [func(data) for data in replicate_data]
+
+    pool = ThreadPool(nthreads)
+    results = pool.map(func, replicate_data)
+    pool.close()
+    pool.join()
+
+    return results
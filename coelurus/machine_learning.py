@@ -6,8 +6,8 @@ import pandas as pd
 import ConfigParser
 import numpy as np
 from coelurus.data_processing import Loader, Validator, DataProcessor
+from coelurus import kernels
 from sklearn.mixture import GaussianMixture
-from multiprocessing.pool import ThreadPool
 
 
 class FeatureIntegrator(object):
@@ -43,16 +43,26 @@ class FeatureIntegrator(object):
         sig_sums = profiles.sum(axis=1)
         profile_probs = profiles.apply(lambda x: x / sig_sums, axis=0)
 
-        for profile in profile_probs:
-            sampled_data = np.random.choice(np.arange(2, profile.shape[0] + 2), size=100000, p=profile.tolist())
+        n_samples = 100000
+        # profiles sampled and fitted at once; peak memory is about twice the sampled data
+        # (64 x 100000 float64 = ~50 MB, plus one copy made by np.percentile in select_gaussian_mixtures)
+        chunk_size = 64
+        fractions = np.arange(2, profile_probs.shape[1] + 2)
+        fitted = {}
 
-            # temp: add noise to the sampled data
-            sampled_data = sampled_data + np.random.normal(0.1,0.5,size=len(sampled_data))
+        for chunk_start in range(0, profile_probs.shape[0], chunk_size):
+            chunk = profile_probs.iloc[chunk_start:chunk_start + chunk_size, :]
+            sampled_data = np.empty((chunk.shape[0], n_samples))
+            for i, probs in enumerate(chunk.values):
+                sampled_data[i] = np.random.choice(fractions, size=n_samples, p=probs)
+                # temp: add noise to the sampled data
+                sampled_data[i] += np.random.normal(0.1, 0.5, size=n_samples)
 
-            # select a Gaussian mixture model using the sampled data
-            models = [GaussianMixture(n_components=i, covariance_type='spherical', reg_covar=5e6) for i in range(1, 6)]
-            models = [model.fit(sampled_data.reshape(-1, 1)) for model in models]
-            bics = [model.bic(sampled_data.reshape(-1, 1)) for model in models]
+            # select a Gaussian mixture model for each profile using BIC, EM runs in parallel over profiles
+            _, best_models = kernels.select_gaussian_mixtures(sampled_data, reg_covar=5e6)
+            fitted.update(zip(chunk.index, best_models))
+
+        return fitted
 
     def extract_wrapper(self, data):
         """
@@ -69,10 +79,7 @@ class FeatureIntegrator(object):
         :return: Pandas DataFrame with rows being profiles and columns new features
         """
         nthreads = self.config.getint('system_options', 'num_threads')
-        pool = ThreadPool(nthreads)
-        results = pool.map(self.extract_wrapper, self.replicate_data_transformed)
-        pool.close()
-        pool.join()
+        results = kernels.map_replicates(self.extract_wrapper, self.replicate_data_transformed, nthreads)
 
         # join together different feature sources for each replicated
         results_joined = [reduce(lambda x, y: x.join(y), z) for z in results]
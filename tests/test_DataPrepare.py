@@ -1,11 +1,16 @@
 """
 Tests for DataProcessor class and its methods. Run by pytest.
 """
+import os
 import sys
+import threading
 #sys.path.append("..")
 from coelurus import Loader, Validator, DataProcessor
+from coelurus import kernels
+import pytest
 import pandas as pd
 import numpy as np
+from sklearn.mixture import GaussianMixture
 # todo: remove example data from tests and set up separate fixtures in a file
 
 def test_imputation1(tmpdir):
@@ -140,4 +145,191 @@ def test_smoothing1(tmpdir):
     dfilter = DataProcessor(val)
     smoothed = dfilter.smooth_profiles(loader.input_data.copy())
 
-    pd.testing.assert_frame_equal(smoothed, expected_result)
\ No newline at end of file
+    pd.testing.assert_frame_equal(smoothed, expected_result)
+
+
+# reference pandas implementations of the sliding-window filters, kernels are tested against them
+# pandas_impute_missing_values is not the original DataProcessor code verbatim: the mean_impute apply (arr[1]) and
+# the window.loc[imp_row] label lookup fail on current pandas, so the imputed value is assigned with iloc instead.
+# The window order and the rounding are the same as in the original loop.
+def pandas_impute_missing_values(profiles):
+
+    profiles = profiles.copy()
+    profiles[profiles == 0] = np.nan
+
+    for i in range(profiles.shape[1] - 2):
+        window = profiles.iloc[:, i:i + 3]
+        imp_row = np.all(window.isna().apply(lambda x: x == [False, True, False], axis=1), axis=1)
+        imp_row = np.where(imp_row)[0]
+        profiles.iloc[imp_row, i + 1] = np.round((window.iloc[imp_row, 0] + window.iloc[imp_row, 2]) / 2, 3)
+
+    return profiles.fillna(value=0)
+
+
+def pandas_remove_singletons(profiles):
+
+    profiles = profiles.copy()
+
+    for i in range(profiles.shape[1] - 2):
+        window = profiles.iloc[:, i:i + 3]
+        win_bool = window == 0
+        idx_to_flatten = win_bool.apply(lambda x: np.all(x == [True, False, True]), axis=1)
+        window.loc[idx_to_flatten, window.columns[1]] = 0
+        profiles.iloc[:, i:i + 3] = window
+
+    return profiles
+
+
+def kernel_test_profiles():
+
+    sample_path = os.path.join(os.path.dirname(__file__), 'sample_data', 'input_data_small.csv')
+    sample_profiles = pd.read_csv(sample_path).iloc[:, 1:].fillna(value=0).astype(np.float64)
+
+    rng = np.random.RandomState(0)
+    random_profiles = pd.DataFrame(rng.choice([0, 0, 0, 1.5, 2, 3.25], size=(200, 30)))
+
+    return [sample_profiles, random_profiles]
+
+
+KERNEL_BACKENDS = ['numpy', 'numba'] if kernels.HAS_NUMBA else ['numpy']
+
+
+def get_kernel(name, backend):
+
+    return getattr(kernels, '_%s_%s' % (name, backend))
+
+
+@pytest.mark.parametrize('backend', KERNEL_BACKENDS)
+def test_impute_kernel_matches_pandas(backend):
+
+    for profiles in kernel_test_profiles():
+        expected_result = pandas_impute_missing_values(profiles)
+
+        values = profiles.values.copy()
+        values[values == 0] = np.nan
+        imputed = np.nan_to_num(get_kernel('impute_missing_values', backend)(values))
+
+        np.testing.assert_array_equal(imputed, expected_result.values)
+
+
+@pytest.mark.parametrize('backend', KERNEL_BACKENDS)
+def test_remove_singletons_kernel_matches_pandas(backend):
+
+    for profiles in kernel_test_profiles():
+        expected_result = pandas_remove_singletons(profiles)
+        flattened = get_kernel('remove_singletons', backend)(profiles.values.copy())
+
+        np.testing.assert_array_equal(flattened, expected_result.values)
+
+
+@pytest.mark.parametrize('backend', KERNEL_BACKENDS)
+def test_gaussian_mixture_kernel_matches_sklearn(backend):
+
+    rng = np.random.RandomState(0)
+    samples = np.vstack([np.concatenate([rng.normal(5, 1, 3000), rng.normal(15, 2, 2000)]) for _ in range(3)])
+    means_init = np.percentile(samples, [25, 75], axis=1).T
+
+    fit_gaussian_mixtures = get_kernel('fit_gaussian_mixtures', backend)
+    weights, means, variances, log_likelihood = fit_gaussian_mixtures(samples, means_init, 1e-6, 1e-3, 100)
+
+    for i in range(samples.shape[0]):
+        model = GaussianMixture(n_components=2, covariance_type='spherical', weights_init=[0.5, 0.5],
+                                means_init=means_init[i].reshape(-1, 1),
+                                precisions_init=np.full(2, 1 / (samples[i].var() + 1e-6)))
+        model.fit(samples[i].reshape(-1, 1))
+
+        np.testing.assert_allclose(weights[i], model.weights_)
+        np.testing.assert_allclose(means[i], model.means_.ravel())
+        np.testing.assert_allclose(variances[i], model.covariances_)
+        np.testing.assert_allclose(log_likelihood[i], model.score(samples[i].reshape(-1, 1)))
+
+
+def test_processor_filters_match_pandas(tmpdir, monkeypatch):
+
+    # create mock config
+    mock_conf = tmpdir.mkdir('mock_config').join('mock_config.ini')
+    mock_conf.write('[data_sources]\ndata_source = local')
+
+    # set up classes and create mock data
+    loader = Loader(str(tmpdir.join('mock_config', 'mock_config.ini')))
+    profiles = kernel_test_profiles()[1]
+    profiles.columns = ['F%dA' % (i + 1) for i in range(profiles.shape[1])]
+    loader.input_data = pd.concat([pd.DataFrame({'protein_id': ['P%d' % i for i in range(profiles.shape[0])]}),
+                                   profiles], axis=1)
+
+    # spy on the selected backend kernels
+    calls = []
+
+    def spy(name, kernel):
+        def wrapped(values):
+            calls.append(name)
+            return kernel(values)
+        return wrapped
+
+    monkeypatch.setattr(kernels, '_impute_missing_values',
+                        spy('impute_missing_values', kernels._impute_missing_values))
+    monkeypatch.setattr(kernels, '_remove_singletons', spy('remove_singletons', kernels._remove_singletons))
+
+    val = Validator(loader)
+    val.basic_quality_passed = True  # the mock config only covers the filters tested here
+    dfilter = DataProcessor(val)
+    imputed = dfilter.impute_missing_values(loader.input_data.copy())
+    flattened = dfilter.remove_singletons(imputed.copy())
+
+    assert calls == ['impute_missing_values', 'remove_singletons']
+
+    expected_imputed = pandas_impute_missing_values(profiles)
+    np.testing.assert_array_equal(imputed.iloc[:, 1:].values, expected_imputed.values)
+    np.testing.assert_array_equal(flattened.iloc[:, 1:].values, pandas_remove_singletons(expected_imputed).values)
+
+
+def test_map_replicates_runs_kernels():
+
+    replicate_data = [profiles.values for profiles in kernel_test_profiles()] * 4
+    threads_used = set()
+
+    def filters(data):
+        threads_used.add(threading.current_thread().name)
+        return kernels.remove_singletons(kernels.impute_missing_values(data))
+
+    # called the same way as in DataProcessor.apply_transformations()
+    results = kernels.map_replicates(filters, replicate_data, 4)
+
+    for data, result in zip(replicate_data, results):
+        np.testing.assert_array_equal(result, kernels.remove_singletons(kernels.impute_missing_values(data)))
+
+    if kernels.BACKEND == 'numba':
+        # parallel Numba kernels must not be launched from several Python threads
+        assert threads_used == {threading.current_thread().name}
+
+
+@pytest.mark.parametrize('modes', [[(5, 1)], [(5, 1), (15, 2)]])
+def test_select_gaussian_mixtures_matches_sklearn_bic(modes):
+
+    rng = np.random.RandomState(0)
+    samples = np.vstack([np.concatenate([rng.normal(mean, sd, 3000) for mean, sd in modes]) for _ in range(2)])
+
+    n_components, models = kernels.select_gaussian_mixtures(samples)
+
+    for i in range(samples.shape[0]):
+        x = samples[i].reshape(-1, 1)
+        bics = [GaussianMixture(n_components=k, covariance_type='spherical', random_state=0).fit(x).bic(x)
+                for k in range(1, 6)]
+
+        assert n_components[i] == np.argmin(bics) + 1 == len(modes)
+        assert len(models[i]) == len(modes)
+        np.testing.assert_allclose(sorted(mean for mean, sd in models[i]), [mean for mean, sd in modes], atol=0.2)
+
+
+@pytest.mark.skipif(not kernels.HAS_NUMBA, reason='Numba is not installed')
+def test_map_replicates_numba_threads_follow_config(tmpdir):
+
+    # create mock config
+    mock_conf = tmpdir.mkdir('mock_config').join('mock_config.ini')
+    mock_conf.write('[data_sources]\ndata_source = local\n[system_options]\nnum_threads = 2')
+    loader = Loader(str(tmpdir.join('mock_config', 'mock_config.ini')))
+
+    nthreads = loader.config.getint('system_options', 'num_threads')
+    numba_threads = kernels.map_replicates(lambda data: kernels.numba.get_num_threads(), [None, None], nthreads)
+
+    assert numba_threads == [min(2, kernels.numba.config.NUMBA_NUM_THREADS)] * 2